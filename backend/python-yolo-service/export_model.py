@@ -0,0 +1,57 @@
+"""
+Export the YOLOv11 model to an optimized inference backend
+Run once on the deployment host before starting the service; main.py picks up the exported model automatically
+
+Usage:
+    python export_model.py engine    # TensorRT FP16 engine (NVIDIA GPU hosts)
+    python export_model.py openvino  # INT8 OpenVINO model (CPU-only hosts)
+"""
+
+import sys
+from ultralytics import YOLO
+
+# Must match PT_MODEL_PATH, IMAGE_SIZE and MAX_BATCH in main.py
+PT_MODEL_PATH = 'yolo11n.pt'
+IMAGE_SIZE = 640
+MAX_BATCH = 8
+# Calibration dataset for INT8 quantization
+INT8_CALIBRATION_DATA = 'coco8.yaml'
+
+
+def export_engine() -> str:
+    """Export a dynamic-batch TensorRT FP16 engine"""
+    return YOLO(PT_MODEL_PATH).export(
+        format='engine',
+        imgsz=IMAGE_SIZE,
+        half=True,
+        dynamic=True,
+        batch=MAX_BATCH,
+        device=0,
+    )
+
+
+def export_openvino() -> str:
+    """Export a dynamic-batch INT8-calibrated OpenVINO model"""
+    return YOLO(PT_MODEL_PATH).export(
+        format='openvino',
+        imgsz=IMAGE_SIZE,
+        int8=True,
+        data=INT8_CALIBRATION_DATA,
+        dynamic=True,
+        batch=MAX_BATCH,
+    )
+
+
+EXPORTERS = {
+    'engine': export_engine,
+    'openvino': export_openvino,
+}
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else 'engine'
+    if target not in EXPORTERS:
+        sys.exit(f"Unknown export target '{target}', expected one of: {', '.join(EXPORTERS)}")
+
+    exported_path = EXPORTERS[target]()
+    print(f"Exported {target} model to {exported_path}")
@@ -5,20 +5,53 @@ Uses YOLOv11 to detect objects in tote photos and return structured item data
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, HttpUrl
-from typing import List, Optional
+from typing import BinaryIO, Dict, List, Optional, Tuple
 import uvicorn
+import asyncio
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from ultralytics import YOLO
 from PIL import Image
 from io import BytesIO
 import logging
+import hashlib
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import numpy as np
+import torch
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="YOLO Object Detection Service", version="2.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the download client and request batcher for this run and tear them down on shutdown"""
+    global HTTP_CLIENT, BATCHER
+    HTTP_CLIENT = create_http_client()
+    BATCHER = InferenceBatcher()
+    BATCHER.start()
+    try:
+        yield
+    finally:
+        await BATCHER.stop()
+        await HTTP_CLIENT.aclose()
+
+
+app = FastAPI(
+    title="YOLO Object Detection Service",
+    version="2.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # CORS middleware
 app.add_middleware(
@@ -29,10 +62,96 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load YOLOv11 model (will download on first run)
-logger.info("Loading YOLOv11 model...")
-model = YOLO('yolo11n.pt')  # 'n' = nano (fastest), can use 's', 'm', 'l', 'x' for better accuracy
-logger.info("YOLOv11 model loaded successfully")
+# Model weights: 'n' = nano (fastest), can use 's', 'm', 'l', 'x' for better accuracy
+PT_MODEL_PATH = 'yolo11n.pt'
+# TensorRT FP16 engine produced by `export_model.py engine` (GPU hosts)
+ENGINE_MODEL_PATH = os.getenv('YOLO_ENGINE_PATH', 'yolo11n.engine')
+# INT8 OpenVINO model produced by `export_model.py openvino` (CPU-only hosts)
+OPENVINO_MODEL_PATH = os.getenv('YOLO_OPENVINO_PATH', 'yolo11n_int8_openvino_model/')
+# Inference resolution, must match the size the engine was exported with
+IMAGE_SIZE = 640
+# Largest batch the dynamic TensorRT/OpenVINO exports accept; detection runs in chunks of this size
+MAX_BATCH = 8
+# Run FP16 on CUDA (the engine is FP16 already, this covers the PyTorch fallback)
+USE_HALF = torch.cuda.is_available()
+
+
+def select_model_path() -> str:
+    """Pick the fastest exported backend for this host, falling back to PyTorch weights"""
+    if torch.cuda.is_available():
+        if os.path.exists(ENGINE_MODEL_PATH):
+            return ENGINE_MODEL_PATH
+    elif os.path.exists(OPENVINO_MODEL_PATH):
+        return OPENVINO_MODEL_PATH
+    return PT_MODEL_PATH
+
+
+def warmup_model(yolo_model: YOLO, batch_sizes: List[int]) -> None:
+    """Run dummy inferences so kernel autotuning and allocation happen before real requests"""
+    blank = np.zeros((IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8)
+    for batch_size in batch_sizes:
+        yolo_model([blank] * batch_size, conf=0.5, imgsz=IMAGE_SIZE, half=USE_HALF, verbose=False)
+
+
+def use_channels_last(yolo_model: YOLO) -> None:
+    """Switch the predictor's PyTorch network to NHWC so FP16 convolutions use Tensor Cores"""
+    yolo_model.predictor.model.to(memory_format=torch.channels_last)
+
+
+def load_model() -> YOLO:
+    """Load the YOLOv11 model for this host and warm it up"""
+    # PyTorch weights will download on first run
+    model_path = select_model_path()
+    logger.info(f"Loading YOLOv11 model from {model_path}...")
+    yolo_model = YOLO(model_path, task='detect')
+    logger.info("YOLOv11 model loaded successfully")
+
+    # Dynamic-batch exports also get a MAX_BATCH warmup to prime their largest profile;
+    # the PyTorch fallback has no profiles, so batch=1 is enough there
+    warmup_model(yolo_model, [1] if model_path == PT_MODEL_PATH else [1, MAX_BATCH])
+
+    # The predictor fuses Conv+BN on its first call, which resets the layout, so convert after warmup
+    if USE_HALF and model_path == PT_MODEL_PATH:
+        use_channels_last(yolo_model)
+        warmup_model(yolo_model, [1])
+    logger.info("YOLOv11 warmup complete")
+    return yolo_model
+
+
+# Shared HTTP session so image downloads reuse pooled keep-alive connections
+SESSION = requests.Session()
+SESSION.mount('http://', HTTPAdapter(pool_connections=32, pool_maxsize=32))
+SESSION.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Async client used by the endpoints so downloads don't block the event loop"""
+    return httpx.AsyncClient(
+        timeout=10.0,
+        # Match requests, which follows storage/CDN redirects by default
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+    )
+
+
+# Default client for use outside a lifespan; lifespan() swaps in a fresh one per run
+HTTP_CLIENT = create_http_client()
+
+# Inference runs off the event loop on a single thread: the shared YOLO predictor is not
+# thread-safe, and one worker also keeps GPU calls serialized
+EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# Default minimum confidence for a detection to be reported
+CONFIDENCE_THRESHOLD = 0.5
+
+# Number of images whose detections are remembered by content hash
+DETECTION_CACHE_SIZE = int(os.getenv('DETECTION_CACHE_SIZE', '1024'))
+
+# How long the batcher waits to fill a batch of concurrent /analyze requests
+BATCH_WAIT_SECONDS = 0.010
+
+# Longest side downloaded images are downscaled to before inference
+MAX_IMAGE_SIDE = 1280
 
 # Map YOLO classes to inventory categories
 CATEGORY_MAPPING = {
@@ -106,6 +225,22 @@ CATEGORY_MAPPING = {
 }
 
 
+def build_class_tables(names: Dict[int, str]) -> Tuple[List[str], List[str]]:
+    """Build category and display-name tables indexed by YOLO class id from the model's fixed class names"""
+    categories = [CATEGORY_MAPPING.get(names[i].lower(), 'uncategorized') for i in range(len(names))]
+    titles = [names[i].title() for i in range(len(names))]
+    return categories, titles
+
+
+# Only the module served as main:app loads the model. `python main.py` also runs this file as
+# __main__ (the uvicorn supervisor) and as __mp_main__ in each spawned worker before uvicorn
+# imports main:app; neither of those serves requests, so they skip the load.
+if __name__ not in ("__main__", "__mp_main__"):
+    model = load_model()
+    # Per-class lookup tables, so mapping a detection needs no string work
+    CATEGORY_BY_ID, NAME_TITLE_BY_ID = build_class_tables(model.names)
+
+
 class AnalyzeRequest(BaseModel):
     photoUrl: HttpUrl
 
@@ -130,104 +265,269 @@ class AnalysisResponse(BaseModel):
     photosAnalyzed: int
 
 
+def analysis_response(items: List[DetectedItem], photos_analyzed: int) -> ORJSONResponse:
+    """Serialize trusted analysis results directly with orjson, skipping re-validation of every item"""
+    result = AnalysisResponse.model_construct(items=items, photosAnalyzed=photos_analyzed)
+    return ORJSONResponse(content=result.model_dump())
+
+
+def downscale_image(image: Image.Image, max_side: int = MAX_IMAGE_SIDE) -> Image.Image:
+    """Shrink oversized images on the CPU so YOLO receives a smaller tensor"""
+    width, height = image.size
+    longest = max(width, height)
+    if longest <= max_side:
+        return image
+
+    scale = max_side / longest
+    new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return image.resize(new_size, Image.Resampling.BILINEAR)
+
+
+def decode_image(fp: BinaryIO) -> Image.Image:
+    """Decode an image file object into a downscaled RGB image"""
+    image = Image.open(fp)
+    # Let JPEG decode at reduced scale when the photo is much larger than needed
+    image.draft('RGB', (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    # Force the decode while the source is still open
+    image.load()
+    return downscale_image(image).convert('RGB')
+
+
+def decode_and_hash(data: bytes) -> Tuple[Image.Image, str]:
+    """Decode downloaded image bytes, returning the image with the sha256 digest of the bytes"""
+    return decode_image(BytesIO(data)), hashlib.sha256(data).hexdigest()
+
+
 def download_image(url: str) -> Image.Image:
     """Download image from URL"""
     try:
-        response = requests.get(url, timeout=10)
+        response = SESSION.get(url, timeout=10)
         response.raise_for_status()
-        return Image.open(BytesIO(response.content))
+        return decode_image(BytesIO(response.content))
     except Exception as e:
         logger.error(f"Failed to download image from {url}: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Failed to download image: {str(e)}")
 
 
-def detect_objects(image: Image.Image, confidence_threshold: float = 0.5) -> List[dict]:
-    """Detect objects using YOLOv8"""
+async def download_image_async(url: str) -> Tuple[Image.Image, str]:
+    """Download image from URL without blocking the event loop, returning it with its sha256 digest"""
     try:
-        # Run inference
-        results = model(image, conf=confidence_threshold)
-
-        detections = []
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                # Get box details
-                cls = int(box.cls[0])
-                conf = float(box.conf[0])
-                class_name = model.names[cls]
-
-                detections.append({
-                    'class': class_name,
-                    'confidence': conf,
-                })
-
-        logger.info(f"Detected {len(detections)} objects")
-        return detections
+        response = await HTTP_CLIENT.get(url)
+        response.raise_for_status()
+        # Hash and decode in a worker thread, both are CPU-bound
+        return await asyncio.to_thread(decode_and_hash, response.content)
+    except Exception as e:
+        logger.error(f"Failed to download image from {url}: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Failed to download image: {str(e)}")
+
+
+# Detections for one image: parallel arrays of class ids (int32) and confidences (float32)
+Detections = Tuple[np.ndarray, np.ndarray]
+
+
+def detect_objects_batch(images: List[Image.Image], confidence_threshold: float = CONFIDENCE_THRESHOLD) -> List[Detections]:
+    """Detect objects in several images with batched YOLO calls of at most MAX_BATCH images"""
+    try:
+        batch_detections = []
+        with torch.inference_mode():
+            # Exported engines only accept batches up to MAX_BATCH, so run in chunks
+            for start in range(0, len(images), MAX_BATCH):
+                chunk = images[start:start + MAX_BATCH]
+                results = model(chunk, conf=confidence_threshold, imgsz=IMAGE_SIZE, half=USE_HALF)
+
+                for result in results:
+                    # Copy class ids and confidences to host once per image instead of per box
+                    cls_ids = result.boxes.cls.cpu().numpy().astype(np.int32)
+                    confs = result.boxes.conf.cpu().numpy().astype(np.float32, copy=False)
+                    batch_detections.append((cls_ids, confs))
+
+        logger.info(f"Detected {sum(len(cls_ids) for cls_ids, _ in batch_detections)} objects in {len(images)} images")
+        return batch_detections
 
     except Exception as e:
         logger.error(f"Detection failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
 
 
-def map_detection_to_item(detection: dict, photo_url: str) -> DetectedItem:
-    """Convert YOLO detection to inventory item format"""
-    class_name = detection['class']
-    confidence_score = detection['confidence']
-
-    # Map to category
-    category = CATEGORY_MAPPING.get(class_name.lower(), 'uncategorized')
+def detect_objects(image: Image.Image, confidence_threshold: float = CONFIDENCE_THRESHOLD) -> Detections:
+    """Detect objects in a single image"""
+    return detect_objects_batch([image], confidence_threshold)[0]
 
-    # Generate item name (capitalize and clean up)
-    item_name = class_name.title()
 
-    # Generate description based on confidence
-    description = f"Detected with {confidence_score:.0%} confidence"
+class DetectionCache:
+    """Bounded LRU cache of detections keyed by (image sha256, confidence threshold)"""
 
-    # Determine confidence level
-    if confidence_score >= 0.8:
-        confidence_level = 'high'
-    elif confidence_score >= 0.5:
-        confidence_level = 'medium'
-    else:
-        confidence_level = 'low'
+    def __init__(self, max_entries: int = DETECTION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
 
-    # Estimate condition (YOLO can't determine this, default to 'good')
-    condition = 'good'
+    def get(self, key: Tuple[str, float]) -> Optional[Detections]:
+        detections = self.entries.get(key)
+        if detections is not None:
+            self.entries.move_to_end(key)
+        return detections
 
-    return DetectedItem(
-        name=item_name,
-        description=description,
-        category=category,
-        quantity=1,
-        condition=condition,
+    def put(self, key: Tuple[str, float], detections: Detections) -> None:
+        self.entries[key] = detections
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+DETECTION_CACHE = DetectionCache()
+
+
+class InferenceBatcher:
+    """Coalesce concurrent single-image detections into batched model calls"""
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_wait: float = BATCH_WAIT_SECONDS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self) -> None:
+        """Start the consumer task on the running event loop"""
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancel the consumer task and fail any requests still waiting in the queue"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        if self.queue is None:
+            return
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(HTTPException(status_code=503, detail="Service shutting down"))
+
+    async def detect(self, image: Image.Image) -> Detections:
+        """Queue an image for the next batch and wait for its detections"""
+        loop = asyncio.get_running_loop()
+        if not self.running:
+            # Batcher not started (e.g. no lifespan events), detect directly
+            return await loop.run_in_executor(EXECUTOR, detect_objects, image)
+
+        future = loop.create_future()
+        await self.queue.put((image, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Image.Image, asyncio.Future]]:
+        """Wait for one queued image, then gather more until the batch is full or the wait expires"""
+        items = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            try:
+                items.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                if time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(0.001)
+        return items
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            images = [image for image, _ in items]
+
+            try:
+                results = await loop.run_in_executor(EXECUTOR, detect_objects_batch, images)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), detections in zip(items, results):
+                # Skip requests that were cancelled while waiting
+                if not future.done():
+                    future.set_result(detections)
+
+
+# Not started outside a lifespan, so detect() runs directly; lifespan() swaps in a started one
+BATCHER = InferenceBatcher()
+
+
+# Confidence level names indexed by rank (low=1, medium=2, high=3)
+CONFIDENCE_LEVEL_NAMES = np.array(['', 'low', 'medium', 'high'])
+
+
+def confidence_ranks(confs: np.ndarray) -> np.ndarray:
+    """Bucket confidence scores into ranks, higher rank = more confident"""
+    return np.where(confs >= 0.8, 3, np.where(confs >= 0.5, 2, 1)).astype(np.int8)
+
+
+def build_item(cls_id: int, confidence_score: float, confidence_level: str,
+               photo_url: str, quantity: int = 1) -> DetectedItem:
+    """Build an inventory item for a YOLO class"""
+    # Values come from the model and lookup tables, so skip validation
+    return DetectedItem.model_construct(
+        # Generate item name (capitalize and clean up)
+        name=NAME_TITLE_BY_ID[cls_id],
+        # Generate description based on confidence
+        description=f"Detected with {confidence_score:.0%} confidence",
+        # Map to category
+        category=CATEGORY_BY_ID[cls_id],
+        quantity=quantity,
+        # Estimate condition (YOLO can't determine this, default to 'good')
+        condition='good',
         confidence=confidence_level,
         aiGenerated=True,
         sourcePhoto=photo_url,
     )
 
 
-def consolidate_items(items: List[DetectedItem]) -> List[DetectedItem]:
-    """Consolidate duplicate items and sum quantities"""
-    item_map = {}
+def consolidate_detections(detections_by_photo: List[Detections], photo_urls: List[str]) -> List[DetectedItem]:
+    """Consolidate detections across photos into one item per class and sum quantities"""
+    # Grouped on the class id arrays so Python only builds one item per distinct class
+    if not detections_by_photo:
+        return []
 
-    for item in items:
-        # Create unique key based on name and category
-        key = f"{item.name.lower()}-{item.category}"
+    cls_ids = np.concatenate([ids for ids, _ in detections_by_photo])
+    if cls_ids.size == 0:
+        return []
+    confs = np.concatenate([scores for _, scores in detections_by_photo])
+    photo_indexes = np.repeat(
+        np.arange(len(detections_by_photo)),
+        [len(ids) for ids, _ in detections_by_photo],
+    )
 
-        if key in item_map:
-            # Increment quantity
-            item_map[key].quantity += 1
+    # Group by class: first occurrence, count and highest confidence rank per class
+    unique_ids, first_indexes, inverse, counts = np.unique(
+        cls_ids, return_index=True, return_inverse=True, return_counts=True
+    )
+    max_ranks = np.zeros(len(unique_ids), dtype=np.int8)
+    np.maximum.at(max_ranks, inverse, confidence_ranks(confs))
 
-            # Update confidence to higher value
-            confidence_levels = {'high': 3, 'medium': 2, 'low': 1}
-            current_level = confidence_levels[item_map[key].confidence]
-            new_level = confidence_levels[item.confidence]
-            if new_level > current_level:
-                item_map[key].confidence = item.confidence
-        else:
-            item_map[key] = item
+    # Keep the order classes were first detected in; the first detection
+    # supplies the description and source photo
+    items = []
+    for group in np.argsort(first_indexes, kind='stable').tolist():
+        first = int(first_indexes[group])
+        items.append(build_item(
+            int(unique_ids[group]),
+            float(confs[first]),
+            str(CONFIDENCE_LEVEL_NAMES[max_ranks[group]]),
+            photo_urls[int(photo_indexes[first])],
+            quantity=int(counts[group]),
+        ))
 
-    return list(item_map.values())
+    return items
 
 
 @app.get("/")
@@ -247,21 +547,20 @@ async def analyze_photo(request: AnalyzeRequest):
     logger.info(f"Analyzing photo: {request.photoUrl}")
 
     # Download image
-    image = download_image(str(request.photoUrl))
-
-    # Detect objects
-    detections = detect_objects(image)
+    image, digest = await download_image_async(str(request.photoUrl))
 
-    # Convert to items
-    items = [map_detection_to_item(det, str(request.photoUrl)) for det in detections]
+    # Reuse detections for an identical image, otherwise detect objects,
+    # batched with any other concurrent /analyze requests
+    cache_key = (digest, CONFIDENCE_THRESHOLD)
+    detections = DETECTION_CACHE.get(cache_key)
+    if detections is None:
+        detections = await BATCHER.detect(image)
+        DETECTION_CACHE.put(cache_key, detections)
 
-    # Consolidate duplicates
-    consolidated_items = consolidate_items(items)
+    # Convert to items, consolidating duplicates
+    consolidated_items = consolidate_detections([detections], [str(request.photoUrl)])
 
-    return AnalysisResponse(
-        items=consolidated_items,
-        photosAnalyzed=1
-    )
+    return analysis_response(consolidated_items, photos_analyzed=1)
 
 
 @app.post("/analyze-multiple", response_model=AnalysisResponse)
@@ -269,33 +568,59 @@ async def analyze_multiple_photos(request: AnalyzeMultipleRequest):
     """Analyze multiple photos and return consolidated detected items"""
     logger.info(f"Analyzing {len(request.photoUrls)} photos")
 
-    all_items = []
+    # Download all images concurrently, skipping any that fail
+    photo_urls = [str(photo_url) for photo_url in request.photoUrls]
+    downloads = await asyncio.gather(
+        *(download_image_async(url) for url in photo_urls),
+        return_exceptions=True,
+    )
+
+    urls = []
+    cache_keys = []
+    detections_by_photo: List[Optional[Detections]] = []
+    pending_indexes = []
+    pending_images = []
+    for url, download in zip(photo_urls, downloads):
+        if isinstance(download, Exception):
+            logger.error(f"Failed to download {url}: {str(download)}")
+            # Continue with other photos
+            continue
 
-    for photo_url in request.photoUrls:
-        try:
-            # Download image
-            image = download_image(str(photo_url))
+        image, digest = download
+        cache_key = (digest, CONFIDENCE_THRESHOLD)
+        cached = DETECTION_CACHE.get(cache_key)
+        if cached is None:
+            pending_indexes.append(len(urls))
+            pending_images.append(image)
 
-            # Detect objects
-            detections = detect_objects(image)
+        urls.append(url)
+        cache_keys.append(cache_key)
+        detections_by_photo.append(cached)
 
-            # Convert to items
-            items = [map_detection_to_item(det, str(photo_url)) for det in detections]
-            all_items.extend(items)
+    if pending_images:
+        # Detect objects across all uncached images in one batched forward pass
+        loop = asyncio.get_running_loop()
+        batch_detections = await loop.run_in_executor(EXECUTOR, detect_objects_batch, pending_images)
 
-        except Exception as e:
-            logger.error(f"Failed to analyze {photo_url}: {str(e)}")
-            # Continue with other photos
-            continue
+        for index, detections in zip(pending_indexes, batch_detections):
+            detections_by_photo[index] = detections
+            DETECTION_CACHE.put(cache_keys[index], detections)
 
-    # Consolidate all items
-    consolidated_items = consolidate_items(all_items)
+    # Convert to items, consolidating duplicates across all photos
+    consolidated_items = consolidate_detections(detections_by_photo, urls)
 
-    return AnalysisResponse(
-        items=consolidated_items,
-        photosAnalyzed=len(request.photoUrls)
-    )
+    return analysis_response(consolidated_items, photos_analyzed=len(request.photoUrls))
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # uvloop is not available on Windows (start-with-ai.bat), use the stock loop there
+    event_loop = "asyncio" if sys.platform == "win32" else "uvloop"
+    # Each worker process loads its own model and runs one inference at a time
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8001,
+        workers=int(os.getenv('WEB_CONCURRENCY', '1')),
+        loop=event_loop,
+        http="httptools",
+    )
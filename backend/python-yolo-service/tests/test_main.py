@@ -4,10 +4,21 @@ Tests the FastAPI endpoints and YOLO detection logic with mocked dependencies
 """
 
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch, MagicMock
 from fastapi.testclient import TestClient
 from PIL import Image
+import hashlib
 import io
+import numpy as np
+import torch
+
+
+def make_detections(*pairs):
+    """Build a (cls_ids, confs) detections tuple from (class id, confidence) pairs"""
+    cls_ids = np.array([cls_id for cls_id, _ in pairs], dtype=np.int32)
+    confs = np.array([conf for _, conf in pairs], dtype=np.float32)
+    return cls_ids, confs
+
 
 # Mock YOLO before importing main
 @pytest.fixture(autouse=True)
@@ -24,6 +35,15 @@ def mock_yolo_model():
         yield mock_model_instance
 
 
+@pytest.fixture(autouse=True)
+def clear_detection_cache():
+    """Start every test with an empty detection cache"""
+    from main import DETECTION_CACHE
+    DETECTION_CACHE.clear()
+    yield
+    DETECTION_CACHE.clear()
+
+
 @pytest.fixture
 def client():
     """Create test client"""
@@ -59,18 +79,15 @@ class TestHealthCheck:
 class TestAnalyzeSinglePhoto:
     """Test single photo analysis endpoint"""
 
-    @patch('main.download_image')
+    @patch('main.download_image_async', new_callable=AsyncMock)
     @patch('main.detect_objects')
     def test_analyze_photo_success(self, mock_detect, mock_download, client, sample_image):
         """Test successful photo analysis"""
         # Mock image download
-        mock_download.return_value = Image.new('RGB', (100, 100))
+        mock_download.return_value = (Image.new('RGB', (100, 100)), 'digest')
 
         # Mock object detection
-        mock_detect.return_value = [
-            {'class': 'laptop', 'confidence': 0.92},
-            {'class': 'mouse', 'confidence': 0.85},
-        ]
+        mock_detect.return_value = make_detections((63, 0.92), (64, 0.85))
 
         request_data = {
             "photoUrl": "http://localhost:3000/uploads/test.jpg"
@@ -91,7 +108,7 @@ class TestAnalyzeSinglePhoto:
         assert data["items"][0]["confidence"] == "high"
         assert data["items"][0]["aiGenerated"] is True
 
-    @patch('main.download_image')
+    @patch('main.download_image_async', new_callable=AsyncMock)
     def test_analyze_photo_download_failure(self, mock_download, client):
         """Test handling of image download failure"""
         mock_download.side_effect = Exception("Failed to download")
@@ -103,12 +120,12 @@ class TestAnalyzeSinglePhoto:
         response = client.post("/analyze", json=request_data)
         assert response.status_code >= 400
 
-    @patch('main.download_image')
+    @patch('main.download_image_async', new_callable=AsyncMock)
     @patch('main.detect_objects')
     def test_analyze_photo_no_detections(self, mock_detect, mock_download, client):
         """Test analysis with no objects detected"""
-        mock_download.return_value = Image.new('RGB', (100, 100))
-        mock_detect.return_value = []
+        mock_download.return_value = (Image.new('RGB', (100, 100)), 'digest')
+        mock_detect.return_value = make_detections()
 
         request_data = {
             "photoUrl": "http://localhost:3000/uploads/test.jpg"
@@ -122,17 +139,77 @@ class TestAnalyzeSinglePhoto:
         assert data["photosAnalyzed"] == 1
 
 
+class TestDetectionCache:
+    """Test caching of detections by image content hash"""
+
+    @patch('main.download_image_async', new_callable=AsyncMock)
+    @patch('main.detect_objects')
+    def test_repeated_image_skips_detection(self, mock_detect, mock_download, client):
+        """Test re-analyzing identical image bytes reuses cached detections"""
+        mock_download.return_value = (Image.new('RGB', (100, 100)), 'same-digest')
+        mock_detect.return_value = make_detections((63, 0.92))
+
+        request_data = {"photoUrl": "http://localhost:3000/uploads/test.jpg"}
+        first = client.post("/analyze", json=request_data)
+        second = client.post("/analyze", json=request_data)
+
+        assert first.status_code == 200
+        assert second.status_code == 200
+        assert second.json()["items"] == first.json()["items"]
+        mock_detect.assert_called_once()
+
+    @patch('main.download_image_async', new_callable=AsyncMock)
+    @patch('main.detect_objects_batch')
+    def test_multiple_only_detects_uncached_images(self, mock_detect, mock_download, client):
+        """Test /analyze-multiple only sends cache misses to the model"""
+        from main import DETECTION_CACHE, CONFIDENCE_THRESHOLD
+
+        DETECTION_CACHE.put(('cached-digest', CONFIDENCE_THRESHOLD), make_detections((64, 0.85)))
+        mock_download.side_effect = lambda url: (
+            Image.new('RGB', (100, 100)),
+            'cached-digest' if 'photo1' in url else 'new-digest',
+        )
+        mock_detect.return_value = [make_detections((63, 0.92))]
+
+        request_data = {
+            "photoUrls": [
+                "http://localhost:3000/uploads/photo1.jpg",
+                "http://localhost:3000/uploads/photo2.jpg"
+            ]
+        }
+        response = client.post("/analyze-multiple", json=request_data)
+        assert response.status_code == 200
+
+        names = sorted(item["name"] for item in response.json()["items"])
+        assert names == ["Laptop", "Mouse"]
+        assert len(mock_detect.call_args[0][0]) == 1
+
+    def test_cache_evicts_least_recently_used(self):
+        """Test the cache stays bounded and evicts the oldest unused entry"""
+        from main import DetectionCache
+
+        cache = DetectionCache(max_entries=2)
+        cache.put(('a', 0.5), [])
+        cache.put(('b', 0.5), [])
+        cache.get(('a', 0.5))
+        cache.put(('c', 0.5), [])
+
+        assert cache.get(('a', 0.5)) == []
+        assert cache.get(('b', 0.5)) is None
+        assert cache.get(('c', 0.5)) == []
+
+
 class TestAnalyzeMultiplePhotos:
     """Test multiple photos analysis endpoint"""
 
-    @patch('main.download_image')
-    @patch('main.detect_objects')
+    @patch('main.download_image_async', new_callable=AsyncMock)
+    @patch('main.detect_objects_batch')
     def test_analyze_multiple_photos_success(self, mock_detect, mock_download, client):
         """Test successful multiple photo analysis"""
-        mock_download.return_value = Image.new('RGB', (100, 100))
-        mock_detect.side_effect = [
-            [{'class': 'laptop', 'confidence': 0.92}],
-            [{'class': 'laptop', 'confidence': 0.88}, {'class': 'mouse', 'confidence': 0.85}],
+        mock_download.side_effect = lambda url: (Image.new('RGB', (100, 100)), f'digest-{url}')
+        mock_detect.return_value = [
+            make_detections((63, 0.92)),
+            make_detections((63, 0.88), (64, 0.85)),
         ]
 
         request_data = {
@@ -154,17 +231,21 @@ class TestAnalyzeMultiplePhotos:
         assert len(laptop_items) == 1
         assert laptop_items[0]["quantity"] == 2  # Consolidated from 2 photos
 
-    @patch('main.download_image')
-    @patch('main.detect_objects')
+        # Both images should be detected in a single batched call
+        mock_detect.assert_called_once()
+        assert len(mock_detect.call_args[0][0]) == 2
+
+    @patch('main.download_image_async', new_callable=AsyncMock)
+    @patch('main.detect_objects_batch')
     def test_analyze_multiple_photos_partial_failure(self, mock_detect, mock_download, client):
         """Test handling when some photos fail to analyze"""
         def download_side_effect(url):
             if "photo1" in url:
-                return Image.new('RGB', (100, 100))
+                return Image.new('RGB', (100, 100)), 'digest'
             raise Exception("Failed to download")
 
         mock_download.side_effect = download_side_effect
-        mock_detect.return_value = [{'class': 'laptop', 'confidence': 0.92}]
+        mock_detect.return_value = [make_detections((63, 0.92))]
 
         request_data = {
             "photoUrls": [
@@ -179,6 +260,157 @@ class TestAnalyzeMultiplePhotos:
         data = response.json()
         # Should still return results from successful photos
         assert data["photosAnalyzed"] == 2
+        assert len(data["items"]) == 1
+        assert data["items"][0]["sourcePhoto"] == "http://localhost:3000/uploads/photo1.jpg"
+
+        # Only the successfully downloaded image is sent to the model
+        assert len(mock_detect.call_args[0][0]) == 1
+
+
+class TestModelSelection:
+    """Test model backend selection"""
+
+    @patch('main.os.path.exists', return_value=True)
+    @patch('main.torch.cuda.is_available', return_value=True)
+    def test_uses_engine_when_cuda_available(self, mock_cuda, mock_exists):
+        """Test TensorRT engine is preferred on CUDA hosts"""
+        from main import select_model_path, ENGINE_MODEL_PATH
+        assert select_model_path() == ENGINE_MODEL_PATH
+
+    @patch('main.os.path.exists', return_value=True)
+    @patch('main.torch.cuda.is_available', return_value=False)
+    def test_uses_openvino_without_cuda(self, mock_cuda, mock_exists):
+        """Test INT8 OpenVINO model is preferred on CPU-only hosts"""
+        from main import select_model_path, OPENVINO_MODEL_PATH
+        assert select_model_path() == OPENVINO_MODEL_PATH
+
+    @patch('main.os.path.exists', return_value=False)
+    @patch('main.torch.cuda.is_available', return_value=False)
+    def test_falls_back_to_pytorch_without_cuda(self, mock_cuda, mock_exists):
+        """Test PyTorch weights are used on CPU when no OpenVINO model has been exported"""
+        from main import select_model_path, PT_MODEL_PATH
+        assert select_model_path() == PT_MODEL_PATH
+
+    @patch('main.os.path.exists', return_value=False)
+    @patch('main.torch.cuda.is_available', return_value=True)
+    def test_falls_back_to_pytorch_without_engine(self, mock_cuda, mock_exists):
+        """Test PyTorch weights are used when no engine has been exported"""
+        from main import select_model_path, PT_MODEL_PATH
+        assert select_model_path() == PT_MODEL_PATH
+
+
+class TestModelWarmup:
+    """Test startup warmup"""
+
+    def test_warmup_runs_each_batch_size(self):
+        """Test warmup runs one dummy inference per requested batch size"""
+        from main import warmup_model, IMAGE_SIZE
+
+        mock_model = Mock()
+        warmup_model(mock_model, [1, 8])
+
+        assert mock_model.call_count == 2
+        first_batch = mock_model.call_args_list[0][0][0]
+        second_batch = mock_model.call_args_list[1][0][0]
+        assert len(first_batch) == 1
+        assert len(second_batch) == 8
+        assert first_batch[0].shape == (IMAGE_SIZE, IMAGE_SIZE, 3)
+
+
+class TestInferenceBatcher:
+    """Test coalescing of concurrent single-image detections"""
+
+    @pytest.mark.asyncio
+    @patch('main.detect_objects_batch')
+    async def test_concurrent_requests_share_one_batch(self, mock_detect_batch):
+        """Test images queued together are detected in a single model call"""
+        import asyncio
+        from main import InferenceBatcher
+
+        mock_detect_batch.side_effect = lambda images: [
+            make_detections((63, 0.9)) for _ in images
+        ]
+
+        batcher = InferenceBatcher(max_batch=8, max_wait=0.05)
+        batcher.start()
+        try:
+            images = [Image.new('RGB', (100, 100)) for _ in range(3)]
+            results = await asyncio.gather(*(batcher.detect(img) for img in images))
+        finally:
+            await batcher.stop()
+
+        mock_detect_batch.assert_called_once()
+        assert len(mock_detect_batch.call_args[0][0]) == 3
+        assert all(r[0].tolist() == [63] for r in results)
+
+    @pytest.mark.asyncio
+    @patch('main.detect_objects_batch')
+    async def test_batch_failure_propagates(self, mock_detect_batch):
+        """Test a failed batch raises in every waiting request"""
+        from main import InferenceBatcher
+
+        mock_detect_batch.side_effect = RuntimeError("boom")
+
+        batcher = InferenceBatcher()
+        batcher.start()
+        try:
+            with pytest.raises(RuntimeError):
+                await batcher.detect(Image.new('RGB', (100, 100)))
+        finally:
+            await batcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_stop_fails_queued_requests(self):
+        """Test requests still queued when the batcher stops are failed instead of hanging"""
+        import asyncio
+        from fastapi import HTTPException
+        from main import InferenceBatcher
+
+        batcher = InferenceBatcher()
+        batcher.start()
+        # Stop the consumer first so the next request stays in the queue
+        batcher.task.cancel()
+        try:
+            await batcher.task
+        except asyncio.CancelledError:
+            pass
+
+        future = asyncio.get_running_loop().create_future()
+        await batcher.queue.put((Image.new('RGB', (100, 100)), future))
+        await batcher.stop()
+
+        with pytest.raises(HTTPException) as exc_info:
+            await future
+        assert exc_info.value.status_code == 503
+
+    def test_lifespan_can_run_twice(self, monkeypatch):
+        """Test each lifespan gets its own open download client and running batcher"""
+        import main
+
+        # Restore the module defaults afterwards so later tests don't see a closed client
+        monkeypatch.setattr(main, 'HTTP_CLIENT', main.HTTP_CLIENT)
+        monkeypatch.setattr(main, 'BATCHER', main.BATCHER)
+
+        for _ in range(2):
+            with TestClient(main.app):
+                assert not main.HTTP_CLIENT.is_closed
+                assert main.BATCHER.running
+            assert main.HTTP_CLIENT.is_closed
+            assert not main.BATCHER.running
+
+    @pytest.mark.asyncio
+    @patch('main.detect_objects')
+    async def test_detects_directly_when_not_started(self, mock_detect):
+        """Test detection falls back to a direct call without the consumer task"""
+        from main import InferenceBatcher
+
+        mock_detect.return_value = make_detections()
+
+        result = await InferenceBatcher().detect(Image.new('RGB', (100, 100)))
+
+        assert result[0].size == 0
+        assert result[1].size == 0
+        mock_detect.assert_called_once()
 
 
 class TestDetectionLogic:
@@ -191,19 +423,63 @@ class TestDetectionLogic:
 
         # Mock YOLO results
         mock_result = Mock()
-        mock_box = Mock()
-        mock_box.cls = [63]  # laptop class
-        mock_box.conf = [0.92]
-        mock_result.boxes = [mock_box]
+        mock_result.boxes.cls = torch.tensor([63.0])  # laptop class
+        mock_result.boxes.conf = torch.tensor([0.92])
         mock_model.return_value = [mock_result]
-        mock_model.names = {63: 'laptop'}
 
         img = Image.new('RGB', (100, 100))
         detections = detect_objects(img, confidence_threshold=0.5)
 
-        assert len(detections) == 1
-        assert detections[0]['class'] == 'laptop'
-        assert detections[0]['confidence'] == 0.92
+        cls_ids, confs = detections
+        assert cls_ids.dtype == np.int32
+        assert confs.dtype == np.float32
+        assert cls_ids.tolist() == [63]
+        assert confs.tolist() == [pytest.approx(0.92)]
+
+    @patch('main.model')
+    def test_detect_objects_batch_with_mock_model(self, mock_model):
+        """Test batched detection returns one set of detections per image"""
+        from main import detect_objects_batch
+
+        first_result = Mock()
+        first_result.boxes.cls = torch.tensor([63.0])  # laptop
+        first_result.boxes.conf = torch.tensor([0.92])
+        second_result = Mock()
+        second_result.boxes.cls = torch.tensor([63.0, 64.0])  # laptop, mouse
+        second_result.boxes.conf = torch.tensor([0.88, 0.85])
+        mock_model.return_value = [first_result, second_result]
+
+        images = [Image.new('RGB', (100, 100)), Image.new('RGB', (100, 100))]
+        batch = detect_objects_batch(images, confidence_threshold=0.5)
+
+        mock_model.assert_called_once()
+        assert mock_model.call_args[0][0] == images
+        assert len(batch) == 2
+        assert batch[0][0].tolist() == [63]
+        assert batch[1][0].tolist() == [63, 64]
+
+    @patch('main.model')
+    def test_detect_objects_batch_splits_large_batches(self, mock_model):
+        """Test more than MAX_BATCH images are detected in chunks the engine accepts"""
+        from main import detect_objects_batch, MAX_BATCH
+
+        def run_model(chunk, **kwargs):
+            results = []
+            for _ in chunk:
+                result = Mock()
+                result.boxes.cls = torch.tensor([63.0])
+                result.boxes.conf = torch.tensor([0.9])
+                results.append(result)
+            return results
+
+        mock_model.side_effect = run_model
+
+        images = [Image.new('RGB', (100, 100)) for _ in range(MAX_BATCH + 2)]
+        batch = detect_objects_batch(images)
+
+        assert len(batch) == MAX_BATCH + 2
+        chunk_sizes = [len(call[0][0]) for call in mock_model.call_args_list]
+        assert chunk_sizes == [MAX_BATCH, 2]
 
     def test_category_mapping(self):
         """Test that detected classes map to correct categories"""
@@ -221,21 +497,38 @@ class TestDetectionLogic:
         # Test sports mapping
         assert CATEGORY_MAPPING['sports ball'] == 'sports'
 
-    def test_map_detection_to_item(self):
+    def test_class_lookup_tables(self):
+        """Test per-class-id category and name tables match the COCO class names"""
+        from main import CATEGORY_BY_ID, NAME_TITLE_BY_ID
+
+        assert CATEGORY_BY_ID[63] == 'electronics'  # laptop
+        assert NAME_TITLE_BY_ID[63] == 'Laptop'
+        assert CATEGORY_BY_ID[0] == 'uncategorized'  # person
+        assert NAME_TITLE_BY_ID[67] == 'Cell Phone'
+
+    def test_build_class_tables(self):
+        """Test lookup tables are built from the model's class names"""
+        from main import build_class_tables
+
+        categories, titles = build_class_tables({0: 'person', 1: 'cell phone', 2: 'Book'})
+
+        assert categories == ['uncategorized', 'electronics', 'books']
+        assert titles == ['Person', 'Cell Phone', 'Book']
+
+    def test_detections_to_item(self):
         """Test detection to item conversion"""
-        from main import map_detection_to_item
+        from main import consolidate_detections
 
-        detection = {
-            'class': 'laptop',
-            'confidence': 0.92
-        }
         photo_url = 'http://test.com/photo.jpg'
 
-        item = map_detection_to_item(detection, photo_url)
+        items = consolidate_detections([make_detections((63, 0.92))], [photo_url])  # laptop
 
+        assert len(items) == 1
+        item = items[0]
         assert item.name == 'Laptop'
         assert item.category == 'electronics'
         assert item.confidence == 'high'
+        assert item.description == 'Detected with 92% confidence'
         assert item.quantity == 1
         assert item.condition == 'good'
         assert item.aiGenerated is True
@@ -243,108 +536,129 @@ class TestDetectionLogic:
 
     def test_confidence_level_mapping(self):
         """Test confidence score to level mapping"""
-        from main import map_detection_to_item
+        from main import consolidate_detections
 
-        # High confidence
-        high_conf = map_detection_to_item({'class': 'laptop', 'confidence': 0.92}, 'url')
-        assert high_conf.confidence == 'high'
+        items = consolidate_detections([make_detections((63, 0.92), (64, 0.65), (67, 0.45))], ['url'])
 
-        # Medium confidence
-        med_conf = map_detection_to_item({'class': 'laptop', 'confidence': 0.65}, 'url')
-        assert med_conf.confidence == 'medium'
-
-        # Low confidence
-        low_conf = map_detection_to_item({'class': 'laptop', 'confidence': 0.45}, 'url')
-        assert low_conf.confidence == 'low'
+        assert [item.confidence for item in items] == ['high', 'medium', 'low']
 
 
 class TestItemConsolidation:
     """Test item consolidation logic"""
 
-    def test_consolidate_duplicate_items(self):
-        """Test consolidating items with same name and category"""
-        from main import consolidate_items, DetectedItem
-
-        items = [
-            DetectedItem(
-                name="Laptop",
-                description="Test",
-                category="electronics",
-                quantity=1,
-                condition="good",
-                confidence="high",
-                sourcePhoto="photo1.jpg"
-            ),
-            DetectedItem(
-                name="Laptop",
-                description="Test",
-                category="electronics",
-                quantity=1,
-                condition="good",
-                confidence="high",
-                sourcePhoto="photo2.jpg"
-            ),
+    def test_consolidate_detections_across_photos(self):
+        """Test detections are grouped per class with summed quantity and highest confidence"""
+        from main import consolidate_detections
+
+        items = consolidate_detections(
+            [
+                make_detections((64, 0.55), (63, 0.65)),
+                make_detections((63, 0.92), (64, 0.45), (63, 0.51)),
+            ],
+            ['photo1.jpg', 'photo2.jpg'],
+        )
+
+        # Order follows first detection
+        assert [item.name for item in items] == ['Mouse', 'Laptop']
+        mouse, laptop = items
+        assert mouse.quantity == 2
+        assert mouse.confidence == 'medium'
+        assert laptop.quantity == 3
+        assert laptop.confidence == 'high'
+        # First detection supplies the description and source photo
+        assert laptop.description == 'Detected with 65% confidence'
+        assert laptop.sourcePhoto == 'photo1.jpg'
+
+    def test_consolidate_detections_mixed_photos(self):
+        """Test consolidation across photos including one without detections"""
+        from main import consolidate_detections
+
+        items = consolidate_detections(
+            [
+                make_detections((63, 0.45), (67, 0.9)),
+                make_detections(),
+                make_detections((67, 0.7), (63, 0.85), (0, 0.6)),
+            ],
+            ['a.jpg', 'b.jpg', 'c.jpg'],
+        )
+
+        assert [item.model_dump() for item in items] == [
+            {
+                'name': 'Laptop', 'description': 'Detected with 45% confidence',
+                'category': 'electronics', 'quantity': 2, 'condition': 'good',
+                'confidence': 'high', 'aiGenerated': True, 'sourcePhoto': 'a.jpg',
+            },
+            {
+                'name': 'Cell Phone', 'description': 'Detected with 90% confidence',
+                'category': 'electronics', 'quantity': 2, 'condition': 'good',
+                'confidence': 'high', 'aiGenerated': True, 'sourcePhoto': 'a.jpg',
+            },
+            {
+                'name': 'Person', 'description': 'Detected with 60% confidence',
+                'category': 'uncategorized', 'quantity': 1, 'condition': 'good',
+                'confidence': 'medium', 'aiGenerated': True, 'sourcePhoto': 'c.jpg',
+            },
         ]
 
-        consolidated = consolidate_items(items)
+    def test_consolidate_no_detections(self):
+        """Test consolidating photos without detections yields no items"""
+        from main import consolidate_detections
+
+        assert consolidate_detections([], []) == []
+        assert consolidate_detections([make_detections()], ['url']) == []
+
+    def test_consolidate_duplicate_items(self):
+        """Test consolidating detections of the same class"""
+        from main import consolidate_detections
+
+        consolidated = consolidate_detections(
+            [make_detections((63, 0.9)), make_detections((63, 0.9))],
+            ['photo1.jpg', 'photo2.jpg'],
+        )
 
         assert len(consolidated) == 1
         assert consolidated[0].quantity == 2
 
     def test_consolidate_different_items(self):
-        """Test that different items are not consolidated"""
-        from main import consolidate_items, DetectedItem
-
-        items = [
-            DetectedItem(
-                name="Laptop",
-                category="electronics",
-                quantity=1,
-                description="", condition="good", confidence="high", sourcePhoto="url"
-            ),
-            DetectedItem(
-                name="Mouse",
-                category="electronics",
-                quantity=1,
-                description="", condition="good", confidence="high", sourcePhoto="url"
-            ),
-        ]
+        """Test that different classes are not consolidated"""
+        from main import consolidate_detections
 
-        consolidated = consolidate_items(items)
+        consolidated = consolidate_detections([make_detections((63, 0.9), (64, 0.9))], ['url'])
 
         assert len(consolidated) == 2
 
     def test_consolidate_confidence_levels(self):
         """Test that higher confidence is preserved when consolidating"""
-        from main import consolidate_items, DetectedItem
-
-        items = [
-            DetectedItem(
-                name="Laptop",
-                category="electronics",
-                quantity=1,
-                confidence="medium",
-                description="", condition="good", sourcePhoto="url"
-            ),
-            DetectedItem(
-                name="Laptop",
-                category="electronics",
-                quantity=1,
-                confidence="high",
-                description="", condition="good", sourcePhoto="url"
-            ),
-        ]
+        from main import consolidate_detections
 
-        consolidated = consolidate_items(items)
+        consolidated = consolidate_detections([make_detections((63, 0.65), (63, 0.9))], ['url'])
 
         assert len(consolidated) == 1
         assert consolidated[0].confidence == "high"
 
 
+class TestResponseSerialization:
+    """Test analysis response serialization"""
+
+    def test_analysis_response_serializes_items(self):
+        """Test trusted results are serialized to the AnalysisResponse JSON shape"""
+        import json
+        from main import analysis_response, consolidate_detections
+
+        items = consolidate_detections([make_detections((63, 0.92))], ['url'])
+        response = analysis_response(items, photos_analyzed=1)
+
+        assert response.media_type == "application/json"
+        data = json.loads(response.body)
+        assert data["photosAnalyzed"] == 1
+        assert data["items"][0]["name"] == "Laptop"
+        assert data["items"][0]["aiGenerated"] is True
+
+
 class TestImageDownload:
     """Test image download functionality"""
 
-    @patch('main.requests.get')
+    @patch('main.SESSION.get')
     def test_download_image_success(self, mock_get):
         """Test successful image download"""
         from main import download_image
@@ -361,8 +675,23 @@ class TestImageDownload:
 
         result = download_image("http://test.com/image.jpg")
         assert isinstance(result, Image.Image)
+        assert result.mode == 'RGB'
+
+    def test_downscale_large_image(self):
+        """Test oversized images are shrunk to the max side, keeping aspect ratio"""
+        from main import downscale_image
+
+        result = downscale_image(Image.new('RGB', (4000, 3000)), max_side=1280)
+        assert result.size == (1280, 960)
+
+    def test_downscale_small_image_unchanged(self):
+        """Test images within the limit are returned as-is"""
+        from main import downscale_image
+
+        img = Image.new('RGB', (640, 480))
+        assert downscale_image(img, max_side=1280) is img
 
-    @patch('main.requests.get')
+    @patch('main.SESSION.get')
     def test_download_image_failure(self, mock_get):
         """Test image download failure"""
         from main import download_image
@@ -372,6 +701,67 @@ class TestImageDownload:
         with pytest.raises(Exception):
             download_image("http://test.com/image.jpg")
 
+    @pytest.mark.asyncio
+    @patch('main.HTTP_CLIENT.get', new_callable=AsyncMock)
+    async def test_download_image_async_success(self, mock_get):
+        """Test successful async image download"""
+        from main import download_image_async
+
+        img = Image.new('RGB', (100, 100))
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format='PNG')
+        mock_response = Mock()
+        mock_response.content = img_bytes.getvalue()
+        mock_response.raise_for_status = Mock()
+        mock_get.return_value = mock_response
+
+        result, digest = await download_image_async("http://test.com/image.jpg")
+        assert isinstance(result, Image.Image)
+        assert result.mode == 'RGB'
+        assert digest == hashlib.sha256(img_bytes.getvalue()).hexdigest()
+        mock_get.assert_awaited_once_with("http://test.com/image.jpg")
+
+    @pytest.mark.asyncio
+    async def test_download_image_async_follows_redirects(self):
+        """Test redirected photo URLs (e.g. storage/CDN links) are followed"""
+        import httpx
+        import main
+        from main import download_image_async
+
+        img = Image.new('RGB', (100, 100))
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format='PNG')
+
+        def handler(request):
+            if request.url.path == '/old.jpg':
+                return httpx.Response(302, headers={'Location': 'http://cdn.test.com/new.jpg'})
+            return httpx.Response(200, content=img_bytes.getvalue())
+
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler),
+            follow_redirects=main.HTTP_CLIENT.follow_redirects,
+        )
+        try:
+            with patch('main.HTTP_CLIENT', client):
+                result, digest = await download_image_async("http://test.com/old.jpg")
+        finally:
+            await client.aclose()
+
+        assert isinstance(result, Image.Image)
+        assert digest == hashlib.sha256(img_bytes.getvalue()).hexdigest()
+
+    @pytest.mark.asyncio
+    @patch('main.HTTP_CLIENT.get', new_callable=AsyncMock)
+    async def test_download_image_async_failure(self, mock_get):
+        """Test async image download failure"""
+        from main import download_image_async
+        from fastapi import HTTPException
+
+        mock_get.side_effect = Exception("Connection error")
+
+        with pytest.raises(HTTPException):
+            await download_image_async("http://test.com/image.jpg")
+
 
 @pytest.mark.parametrize("object_class,expected_category", [
     ("laptop", "electronics"),